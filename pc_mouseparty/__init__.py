@@ -1,22 +1,22 @@
-"""Top-level package for pc_mouseparty."""
-
-__author__ = """Christopher Marais"""
-__email__ = 'padillacoreanolab@gmail.com'
-__version__ = '0.1.2'
-
-import pkgutil
-
-__all__ = []
-
-for finder, name, ispkg in pkgutil.walk_packages(__path__):
-    if ispkg:
-        __all__.append(name)
-        import_module = f'.{name}'
-    else:
-        import_module = f'.{name}'
-        __all__.append(name.split('.')[0])
-
-    try:
-        globals()[name] = __import__(import_module, globals(), locals(), [], 0)
-    except ModuleNotFoundError:
-        pass
+"""Top-level package for pc_mouseparty."""
+
+__author__ = """Christopher Marais"""
+__email__ = 'padillacoreanolab@gmail.com'
+__version__ = '0.1.2'
+
+import importlib
+import pkgutil
+
+__all__ = [name for finder, name, ispkg in pkgutil.iter_modules(__path__)]
+
+
+def __getattr__(name):
+    """
+    Imports a subpackage the first time it is accessed as an attribute,
+    so that `import pc_mouseparty` does not import every subpackage.
+    """
+    if name in __all__:
+        module = importlib.import_module(f'.{name}', __name__)
+        globals()[name] = module
+        return module
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
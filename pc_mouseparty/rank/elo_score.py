@@ -2,7 +2,6 @@ import os
 import pandas as pd
 import matplotlib.pyplot as plt
 import re
-from collections import defaultdict
 from elorating import calculation
 
 import warnings
@@ -10,6 +9,11 @@ import warnings
 # Suppress all warnings
 warnings.filterwarnings("ignore")
 
+# Animal IDs in the match column of reward competition, i.e. "1.1 vs 1.2"
+_ANIMAL_ID_REGEX = re.compile(r"[-+]?(?:\d*\.\d+|\d+)")
+# Winner cells that hold a single animal ID, i.e. "1.2"
+_WINNER_ID_REGEX = re.compile(r"^-?\d+(?:\.\d+)$")
+
 
 def __reward_competition(df, cohort, output_dir, plot_flag=True):
     """
@@ -36,10 +40,8 @@ def __reward_competition(df, cohort, output_dir, plot_flag=True):
         [col for col in df.columns if all(word not in col
                                           for word in to_remove)]
     df = df[cols_to_keep]
-    df["animal_ids"] = df["match"].apply(
-        lambda x: tuple(sorted([all_ids.strip()
-                                for all_ids in
-                                re.findall(r"[-+]?(?:\d*\.\d+|\d+)", x)])))
+    df["animal_ids"] = \
+        df["match"].str.findall(_ANIMAL_ID_REGEX).apply(sorted).apply(tuple)
     df["cohort"] = "TODO"
     cage_to_strain = {}
     df["strain"] = df["cage"].astype(str).map(cage_to_strain)
@@ -48,84 +50,77 @@ def __reward_competition(df, cohort, output_dir, plot_flag=True):
     df["index"] = df.index
     reward_competition_df = df.reset_index(drop=True)
 
+    # Only the trial columns hold winners, so only those are melted
+    trial_cols = [col for col in reward_competition_df.columns
+                  if "trial" in col]
     melted_rc_df = reward_competition_df.melt(
         id_vars=["index", "date", "cage", "box", "match", "animal_ids"],
+        value_vars=trial_cols,
         var_name="trial",
         value_name="winner")
 
     melted_rc_df = melted_rc_df.dropna(subset="winner")
-    melted_rc_df["keep_row"] = melted_rc_df["winner"].apply(
-        lambda x: True if "tie" in str(x).lower() or
-                          re.match(r'^-?\d+(?:\.\d+)$', str(x)) else False
-    )
+    # The cage repeats on every row, so it is stored as a category
+    # to group on integer codes instead of objects
+    melted_rc_df["cage"] = melted_rc_df["cage"].astype("category")
+    winner_str = melted_rc_df["winner"].astype(str)
+    lowercase_winner = winner_str.str.lower()
+    match_is_tie = lowercase_winner.str.contains("tie", regex=False)
+    melted_rc_df["keep_row"] = \
+        match_is_tie | winner_str.str.match(_WINNER_ID_REGEX)
 
     melted_rc_df = melted_rc_df[melted_rc_df["keep_row"]]
 
-    melted_rc_df["winner"] = melted_rc_df["winner"].astype(str).apply(
-        lambda x: x.lower().strip()
-    )
-
-    melted_rc_df["match_is_tie"] = melted_rc_df["winner"].apply(
-        lambda x: True if "tie" in x.lower().strip() else False
-    )
-
+    # Reusing the lowercase winners and ties of the rows that were kept
     melted_rc_df["winner"] = \
-        melted_rc_df.apply(
-            lambda x: x["animal_ids"][0] if x["match_is_tie"]
-            else x["winner"], axis=1
-        )
-
-    melted_rc_df[melted_rc_df["match_is_tie"]]
+        lowercase_winner[melted_rc_df.index].str.strip()
+    melted_rc_df["match_is_tie"] = match_is_tie[melted_rc_df.index]
 
-    melted_rc_df = \
-        melted_rc_df[melted_rc_df["trial"].str.contains('trial')]
-
-    melted_rc_df["trial_number"] = melted_rc_df["trial"].apply(
-        lambda x:
-        int(x.lower().strip("trial").strip("winner").strip("_"))
+    # Ties are counted with the first animal as the winner
+    melted_rc_df["winner"] = melted_rc_df["winner"].mask(
+        melted_rc_df["match_is_tie"], melted_rc_df["animal_ids"].str[0]
     )
 
+    # Getting the number out of trial column names like "trial_1_winner"
+    melted_rc_df["trial_number"] = melted_rc_df["trial"].str.extract(
+        r"(\d+)", expand=False).astype("int32")
+
     melted_rc_df = melted_rc_df.sort_values(
-        ["index", "trial_number"]).reset_index(drop=True)
+        ["index", "trial_number"], ignore_index=True)
 
-    melted_rc_df["loser"] = melted_rc_df.apply(
-        lambda x:
-        (list(set(x["animal_ids"]) - set([x["winner"]]))[0]), axis=1
-    )
+    # The loser is whichever of the two animals in the match did not win
+    first_id = melted_rc_df["animal_ids"].str[0]
+    second_id = melted_rc_df["animal_ids"].str[1]
+    melted_rc_df["loser"] = \
+        second_id.where(melted_rc_df["winner"] == first_id, first_id)
 
+    # 1 for the first row and every row whose date differs from the row above
     melted_rc_df["session_number_difference"] = \
-        melted_rc_df["date"].astype('category').cat.codes.diff()
-
-    cage_to_elo_rating_dict = defaultdict(dict)
-
-    for cage in melted_rc_df["cage"].unique():
-        cage_df = melted_rc_df[melted_rc_df["cage"] == cage]
-        cage_to_elo_rating_dict[cage] = \
-            calculation.iterate_elo_rating_calculation_for_dataframe(
-                dataframe=cage_df,
-                winner_id_column="winner",
-                loser_id_column="loser",
-                additional_columns=melted_rc_df.columns,
-                tie_column="match_is_tie"
-            )
-
-    cage_to_elo_rating_dict[list(cage_to_elo_rating_dict.keys())[0]][0]
-
-    all_cage_elo_rating_list = []
-
-    for key in cage_to_elo_rating_dict.keys():
-        cage_elo_rating_df = \
-            pd.DataFrame.from_dict(
-                cage_to_elo_rating_dict[key], orient="index")
-        cage_elo_rating_df.insert(
-            0, 'total_trial_number', range(0, 0 + len(cage_elo_rating_df))
+        melted_rc_df["date"].ne(melted_rc_df["date"].shift()).astype('int8')
+
+    # Every column of the melted df is carried over to the elo ratings
+    additional_columns = melted_rc_df.columns.tolist()
+    cage_to_elo_rating_dict = {
+        cage: calculation.iterate_elo_rating_calculation_for_dataframe(
+            dataframe=cage_df,
+            winner_id_column="winner",
+            loser_id_column="loser",
+            additional_columns=additional_columns,
+            tie_column="match_is_tie"
         )
-
-        all_cage_elo_rating_list.append(cage_elo_rating_df)
-
-    all_elo_df = pd.concat(all_cage_elo_rating_list)
-
-    all_elo_df[all_elo_df["match_is_tie"]]
+        for cage, cage_df in melted_rc_df.groupby("cage", sort=False,
+                                                  observed=True)
+    }
+    all_elo_df = pd.concat(cage_to_elo_rating_dict.values(),
+                           ignore_index=True)
+    # Storing the cage and subject of every elo rating as categories
+    for col in ["cage", "subject_id"]:
+        all_elo_df[col] = all_elo_df[col].astype("category")
+    # Numbering the trials of each cage from 0
+    all_elo_df.insert(
+        0, 'total_trial_number',
+        all_elo_df.groupby("cage", sort=False, observed=True).cumcount()
+    )
 
     if cage_to_strain:
         all_elo_df["strain"] = \
@@ -133,62 +128,49 @@ def __reward_competition(df, cohort, output_dir, plot_flag=True):
 
     all_elo_df["experiment_type"] = "Reward Competition"
     all_elo_df["cohort"] = "TODO"
-    all_elo_df[all_elo_df["win_draw_loss"] == 0.5]
 
-    id_to_elo_dict = defaultdict(dict)
-    sorted_func = enumerate(sorted(all_elo_df["subject_id"].unique()))
-    for index, subject_id in sorted_func:
-        per_subject_df = all_elo_df[all_elo_df["subject_id"] == subject_id]
-        id_to_elo_dict[index]["subject_id"] = subject_id
-
-        id_to_elo_dict[index]["final_elo_rating"] = \
-            per_subject_df.iloc[-1]["updated_elo_rating"]
-        id_to_elo_dict[index]["cohort"] = per_subject_df.iloc[-1]["cohort"]
-        id_to_elo_dict[index]["cage"] = per_subject_df.iloc[-1]["cage"]
-
-    id_to_elo_df = pd.DataFrame.from_dict(
-        id_to_elo_dict, orient="index"
+    # The last row of each subject has its final elo rating
+    id_to_elo_df = all_elo_df.drop_duplicates(
+        subset="subject_id", keep="last"
+    )[["subject_id", "updated_elo_rating", "cohort", "cage"]].rename(
+        columns={"updated_elo_rating": "final_elo_rating"}
     )
     # Adding protocol name
     id_to_elo_df["experiment_type"] = "Reward Competition"
     # Adding rank
     id_to_elo_df["rank"] = \
-        id_to_elo_df.groupby("cage")["final_elo_rating"].rank(
-            "dense", ascending=False
-        )
+        id_to_elo_df.groupby(
+            "cage", sort=False, observed=True
+        )["final_elo_rating"].rank("dense", ascending=False)
     # Sorting by cage and then id
     id_to_elo_df = id_to_elo_df.sort_values(
-        by=['cage', "subject_id"], ascending=True).reset_index(drop=True)
-    id_to_elo_df["rank"] = \
-        id_to_elo_df.groupby("cage")["final_elo_rating"].rank(
-            "dense", ascending=False
-        )
-    id_to_elo_df = id_to_elo_df.sort_values(
-        by=['cage', "subject_id"], ascending=True).reset_index(drop=True)
+        by=['cage', "subject_id"], ascending=True, ignore_index=True)
+
+    # Making sure the out dir exists for the plots and the csv
+    os.makedirs(output_dir, exist_ok=True)
 
     if plot_flag:
-        for cage in all_elo_df["cage"].unique():
-            fig, ax = plt.subplots()
-            plt.rcParams["figure.figsize"] = (18, 10)
-            per_cage_df = \
-                all_elo_df[all_elo_df["cage"] == cage]
-
-            for index in per_cage_df["index"].unique():
-                col = "total_trial_number"
-                first_session_in_trial = \
-                    per_cage_df[per_cage_df["index"] == index].iloc[0][col]
-                plt.vlines(x=[first_session_in_trial - 0.5],
-                           ymin=700,
-                           ymax=1300,
-                           colors='black',
-                           linestyle='dashed'
-                           )
-
-            # Drawing a line for each subject
-            for subject in sorted(per_cage_df["subject_id"].unique()):
-                # Getting all the rows with the current subject
-                col = "subject_id"
-                subject_df = per_cage_df[per_cage_df[col] == subject]
+        plt.rcParams["figure.figsize"] = (18, 10)
+        # One figure is reused for every cage, clearing it between cages
+        fig, ax = plt.subplots()
+        for cage, per_cage_df in all_elo_df.groupby("cage", sort=False,
+                                                    observed=True):
+            ax.cla()
+
+            # Drawing a line before the first trial of every match
+            first_trial_of_match = per_cage_df.groupby(
+                "index", sort=False)["total_trial_number"].first()
+            plt.vlines(x=first_trial_of_match.to_numpy() - 0.5,
+                       ymin=700,
+                       ymax=1300,
+                       colors='black',
+                       linestyle='dashed'
+                       )
+
+            # Drawing a line for each subject, with all the rows of the
+            # current subject in sorted order of the subject ids
+            for subject, subject_df in per_cage_df.groupby("subject_id",
+                                                           observed=True):
                 # Making the dates into days after the first session by
                 # subtracting all the dates by the first date
                 plt.plot(subject_df["total_trial_number"],
@@ -209,12 +191,9 @@ def __reward_competition(df, cohort, output_dir, plot_flag=True):
             plt.xticks(rotation=90)
             plt.ylim(700, 1300)
 
-            # Checking if out dir exists
-            if not os.path.exists(output_dir):
-                os.makedirs(output_dir)
-
             file_name = "reward_competition_cage" + str(cage) + ".png"
             plt.savefig(os.path.join(output_dir, file_name))
+        plt.close(fig)
 
     file_name = "reward_competition_cage" + all_cages + ".csv"
     path = os.path.join(output_dir, file_name)
@@ -246,23 +225,21 @@ def __process(df, protocol, cohort, sheet, output_dir, plot_flag=True):
             df.columns = find_col_names.iloc[0]
             df = df[df.index != find_col_names.index[0]]
 
+        # finding column names for cage, winner, loser, and tie
+        # the last column containing each keyword is used
+        lowercase_to_col = {str(col).lower(): col for col in df.columns}
+        cage_col, winner_col, loser_col, tie_col = (
+            next((col for lowercase, col in reversed(lowercase_to_col.items())
+                  if keyword in lowercase), None)
+            for keyword in ("cage", "winner", "loser", "tie"))
+
         # check if there is a cage number col
         mode_cage = None
-        cage_num = False
-        # finding column names for winner, loser, and tie
-        winner_col, tie_col, loser_col = None, None, None
-        for col in df.columns.tolist():
-            if "cage" in col.lower():
-                # filling all cage values with mode
-                mode_cage = df['cage #'].mode().iloc[0]
-                df['cage#'] = mode_cage
-                cage_num = True
-            if "winner" in col.lower():
-                winner_col = col
-            if "loser" in col.lower():
-                loser_col = col
-            if "tie" in col.lower():
-                tie_col = col
+        cage_num = cage_col is not None
+        if cage_num:
+            # filling all cage values with mode
+            mode_cage = df[cage_col].mode().iat[0]
+            df['cage#'] = mode_cage
 
         if not winner_col or not loser_col:
             print("Winner or Loser column not found")
@@ -281,31 +258,21 @@ def __process(df, protocol, cohort, sheet, output_dir, plot_flag=True):
         df = df.dropna(subset=['winner', 'loser'], how='all')
 
         # Autofill dates
-        df['date'] = pd.to_datetime(df['date'], errors='coerce')
-        df['date'].fillna(method='ffill', inplace=True)
+        df['date'] = pd.to_datetime(df['date'], errors='coerce').ffill()
 
         # Identify sessions based on date values
-        df['session_number_difference'] = 0
-        previous_date = None
-        for index, row in df.iterrows():
-            current_date = row['date']
-            # check for session change
-            if not previous_date:
-                df.at[index, 'session_number_difference'] = 1
-            elif previous_date is not None and current_date != previous_date:
-                df.at[index, 'session_number_difference'] = 1
-            previous_date = current_date
+        # 1 where the date differs from the previous row
+        df['session_number_difference'] = \
+            df['date'].ne(df['date'].shift()).astype('int8')
         # Elo Score from calculation.py
         if tie_col:
             df[tie_col] = df[tie_col].notna()
 
-        elo_calc = calculation.iterate_elo_rating_calculation_for_dataframe(
+        elo_df = calculation.iterate_elo_rating_calculation_for_dataframe(
             dataframe=df, winner_id_column=winner_col,
             loser_id_column=loser_col,
             tie_column=tie_col
         )
-        elo_df = pd.DataFrame.from_dict(elo_calc, orient='index')
-        elo_df.groupby("subject_id").count()
 
         cage_to_strain = {}
         if cage_to_strain:
@@ -316,8 +283,7 @@ def __process(df, protocol, cohort, sheet, output_dir, plot_flag=True):
         elo_df["experiment_type"] = protocol
         elo_df["cohort"] = cohort
 
-        if not os.path.exists(output_dir):
-            os.makedirs(output_dir)
+        os.makedirs(output_dir, exist_ok=True)
 
         if plot_flag:
             max_elo_rating = elo_df["updated_elo_rating"].max()
@@ -330,17 +296,17 @@ def __process(df, protocol, cohort, sheet, output_dir, plot_flag=True):
             col = "session_number_difference"
             elo_df[col] = df[col].repeat(2).reset_index(drop=True)
 
-            for index, row in elo_df[elo_df[col].astype(bool)].iterrows():
-                # Offsetting by 0.5 to avoid drawing the line on the dot
-                # Drawing the lines above the max and below the minimum
-                plt.vlines(x=[row["total_match_number"] - 0.5],
-                           ymin=min_elo_rating - 50,
-                           ymax=max_elo_rating + 50,
-                           colors='black',
-                           linestyle='dashed')
-            for subject in sorted(elo_df["subject_id"].unique()):
-                # Getting all the rows with the current subject
-                subject_dataframe = elo_df[elo_df["subject_id"] == subject]
+            session_match_numbers = \
+                elo_df.loc[elo_df[col].astype(bool), "total_match_number"]
+            # Offsetting by 0.5 to avoid drawing the line on the dot
+            # Drawing the lines above the max and below the minimum
+            plt.vlines(x=session_match_numbers.to_numpy() - 0.5,
+                       ymin=min_elo_rating - 50,
+                       ymax=max_elo_rating + 50,
+                       colors='black',
+                       linestyle='dashed')
+            # Getting all the rows of each subject, in sorted subject order
+            for subject, subject_dataframe in elo_df.groupby("subject_id"):
                 # Making the current match number the X-Axis
                 plt.plot(subject_dataframe["total_match_number"],
                          subject_dataframe["updated_elo_rating"],
@@ -358,6 +324,7 @@ def __process(df, protocol, cohort, sheet, output_dir, plot_flag=True):
             plt.ylim(min_elo_rating - 50, max_elo_rating + 50)
             file_name = protocol + "_cage" + str(mode_cage) + ".png"
             fig.savefig(os.path.join(output_dir, file_name))
+            plt.close(fig)
 
         # Saving df csv to output dir
         file_name = protocol + "_cage" + str(mode_cage) + ".csv"
@@ -387,9 +354,9 @@ def generate_elo_scores(file_info, output_dir, plot_flag=True):
         protocol = file_data["protocol"]
         sheets = file_data["sheet"]
         cohort = file_data["cohort"]
-        xls = pd.ExcelFile(file_path)
-        for sheet in sheets:
-            data = pd.read_excel(xls, sheet_name=sheet)
+        # Reading all the sheets of the file in one call
+        sheet_to_data = pd.read_excel(file_path, sheet_name=sheets)
+        for sheet, data in sheet_to_data.items():
             if protocol == "reward_competition":
                 __reward_competition(df=data,
                                      cohort=cohort,
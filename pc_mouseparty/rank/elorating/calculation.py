@@ -5,6 +5,7 @@ Based on: https://www.omnicalculator.com/sports/elo
 """
 import operator
 from collections import defaultdict
+import numpy as np
 import pandas as pd
 
 
@@ -94,105 +95,107 @@ def iterate_elo_rating_calculation_for_dataframe(dataframe, winner_id_column, lo
                                                  additional_columns=None):
     """
     Iterates through a dataframe that has the ID of winners and losers for a given event.
-    A dictionary will be created that contains the information of the event,
-    which can then be turned into a dataframe. Each key is either from winner or loser's perspective.
+    A dataframe will be created that contains the information of the event,
+    with each row either from the winner or loser's perspective.
 
     Args:
         dataframe(Pandas DataFrame):
         winner_id_column(str): The name of the column that has the winner's ID
         loser_id_column(str): The name of the column that has the loser's ID
+        tie_column(str): The name of the column that has whether or not the event was a tie
+            - Truthy values count as a tie, and missing values count as not a tie
         additional_columns(list): Additional columns to take from the
 
     Returns:
-        Dict: With a key value pair for each event either from the winner or loser's perspective.
-            This can be turned into a dataframe with each key value pair being a row.
+        DataFrame: With a row for each event from the winner's perspective,
+            followed by a row from the loser's perspective.
     """
     if additional_columns is None:
         additional_columns = []
 
-    # Dictionary that keeps track of the current Elo rating of the subject
-    id_to_elo_rating = defaultdict(lambda: 1000)
-    # Dictionary that will be converted to a DataFrame
-    index_to_elo_rating_and_meta_data = defaultdict(dict)
+    # Dictionary of column names to the values of each row, that will be converted to a DataFrame
+    # Each match adds a row from the winner's perspective, followed by a row from the loser's perspective
+    column_to_elo_rating_and_meta_data = {column: [] for column in [
+        "total_match_number", "subject_id", "agent_id", "original_elo_rating", "updated_elo_rating",
+        "win_draw_loss", "subject_ranking", "agent_ranking", "pairing_index"]}
 
-    # Indexes that will identify which row the dictionary key value pair will be
-    # The number of the index has no significance other than being the number of the row
-    all_indexes = iter(range(0, 99999))
-
-    # Keeping track of the number of matches
-    total_match_number = 1
-
-    # Making a copy in case there is an error with changing the type of the tie column
-    copied_dataframe = dataframe.copy()
-    # Changing the tie column type to bool
+    # Only taking the columns that are read, instead of copying the whole dataframe
+    used_columns = [winner_id_column, loser_id_column] + ([tie_column] if tie_column else []) + list(additional_columns)
+    all_matches_dataframe = dataframe[list(dict.fromkeys(used_columns))].dropna(subset=winner_id_column)
+    # Changing the tie column to booleans once, with missing values not counting as ties
     # So that we can filter out for booleans including False and 0
-    try:
-        copied_dataframe[tie_column] = copied_dataframe[tie_column].astype(bool)
-    except:
-        copied_dataframe = dataframe.copy()
-
-    for index, row in copied_dataframe.dropna(subset=winner_id_column).iterrows():
-        # Getting the ID of the winner subject
-        winner_id = row[winner_id_column]
-        # Getting the ID of the loser subject
-        loser_id = row[loser_id_column]
-
+    if tie_column:
+        all_tie_values = all_matches_dataframe[tie_column].fillna(0).astype(bool).tolist()
+    else:
+        all_tie_values = [False] * len(all_matches_dataframe)
+
+    # Turning the winner and loser IDs into integer codes, numbered in the order that the subjects are first seen
+    # So that the Elo ratings can be kept in a list, and the rankings in an array,
+    # instead of dictionaries keyed by the IDs
+    id_codes, all_ids = pd.factorize(
+        all_matches_dataframe[[winner_id_column, loser_id_column]].to_numpy().ravel(), use_na_sentinel=False)
+    winner_codes = id_codes[0::2].tolist()
+    loser_codes = id_codes[1::2].tolist()
+
+    # List that keeps track of the current Elo rating of each subject's code
+    elo_ratings = [1000] * len(all_ids)
+
+    # Iterating through plain lists of each column, instead of building a Series for every row with iterrows
+    all_winner_ids = all_matches_dataframe[winner_id_column].tolist()
+    all_loser_ids = all_matches_dataframe[loser_id_column].tolist()
+    for winner_id, loser_id, winner_code, loser_code, is_tie in zip(all_winner_ids, all_loser_ids, winner_codes,
+                                                                    loser_codes, all_tie_values):
         # Getting the current Elo Score
-        current_winner_rating = id_to_elo_rating[winner_id]
-        current_loser_rating = id_to_elo_rating[loser_id]
-
-        if tie_column:
-            # When there is nothing in the tie column
-            # Or when there is a false value indicating that it is not a tie
-            if pd.isna(copied_dataframe[tie_column][index]) or ~(copied_dataframe[tie_column][index]).any():
-                winner_score = 1
-                loser_score = 0
-            # When there is value in the tie column
-            else:
-                winner_score = 0.5
-                loser_score = 0.5
-        # When there is no tie column
+        current_winner_rating = elo_ratings[winner_code]
+        current_loser_rating = elo_ratings[loser_code]
+
+        # When there is value in the tie column
+        if is_tie:
+            winner_score = 0.5
+            loser_score = 0.5
+        # When there is nothing in the tie column, a false value indicating that it is not a tie,
+        # or when there is no tie column
         else:
             winner_score = 1
             loser_score = 0
 
-        # Updating the dictionary with ID keys and Elo Score values
-        update_elo_rating(winner_id=winner_id, loser_id=loser_id, id_to_elo_rating=id_to_elo_rating, \
+        # Updating the list of Elo ratings, which works the same as a dictionary with the codes as keys
+        update_elo_rating(winner_id=winner_code, loser_id=loser_code, id_to_elo_rating=elo_ratings, \
                           winner_score=winner_score, loser_score=loser_score)
 
-        # Saving all the data for the winner
-        winner_index = next(all_indexes)
-        index_to_elo_rating_and_meta_data[winner_index]["total_match_number"] = total_match_number
-        index_to_elo_rating_and_meta_data[winner_index]["subject_id"] = winner_id
-        index_to_elo_rating_and_meta_data[winner_index]["agent_id"] = loser_id
-        index_to_elo_rating_and_meta_data[winner_index]["original_elo_rating"] = current_winner_rating
-        index_to_elo_rating_and_meta_data[winner_index]["updated_elo_rating"] = id_to_elo_rating[winner_id]
-        index_to_elo_rating_and_meta_data[winner_index]["win_draw_loss"] = winner_score
-        index_to_elo_rating_and_meta_data[winner_index]["subject_ranking"] = get_ranking_from_elo_rating_dictionary(
-            id_to_elo_rating, winner_id)
-        index_to_elo_rating_and_meta_data[winner_index]["agent_ranking"] = get_ranking_from_elo_rating_dictionary(
-            id_to_elo_rating, loser_id)
-        index_to_elo_rating_and_meta_data[winner_index]["pairing_index"] = 0
-        for column in additional_columns:
-            index_to_elo_rating_and_meta_data[winner_index][column] = row[column]
-
-            # Saving all the data for the loser
-        loser_index = next(all_indexes)
-        index_to_elo_rating_and_meta_data[loser_index]["total_match_number"] = total_match_number
-        index_to_elo_rating_and_meta_data[loser_index]["subject_id"] = loser_id
-        index_to_elo_rating_and_meta_data[loser_index]["agent_id"] = winner_id
-        index_to_elo_rating_and_meta_data[loser_index]["original_elo_rating"] = current_loser_rating
-        index_to_elo_rating_and_meta_data[loser_index]["updated_elo_rating"] = id_to_elo_rating[loser_id]
-        index_to_elo_rating_and_meta_data[loser_index]["win_draw_loss"] = loser_score
-        index_to_elo_rating_and_meta_data[loser_index]["subject_ranking"] = get_ranking_from_elo_rating_dictionary(
-            id_to_elo_rating, loser_id)
-        index_to_elo_rating_and_meta_data[loser_index]["agent_ranking"] = get_ranking_from_elo_rating_dictionary(
-            id_to_elo_rating, winner_id)
-        index_to_elo_rating_and_meta_data[loser_index]["pairing_index"] = 1
-        for column in additional_columns:
-            index_to_elo_rating_and_meta_data[loser_index][column] = row[column]
-
-            # Updating the match number
-        total_match_number += 1
-
-    return index_to_elo_rating_and_meta_data
+        # Saving all the data for the winner and then the loser
+        column_to_elo_rating_and_meta_data["subject_id"] += [winner_id, loser_id]
+        column_to_elo_rating_and_meta_data["agent_id"] += [loser_id, winner_id]
+        column_to_elo_rating_and_meta_data["original_elo_rating"] += [current_winner_rating, current_loser_rating]
+        column_to_elo_rating_and_meta_data["updated_elo_rating"] += [elo_ratings[winner_code], elo_ratings[loser_code]]
+        column_to_elo_rating_and_meta_data["win_draw_loss"] += [winner_score, loser_score]
+
+    # The match number and whether the row is from the winner (0) or loser (1) come from the row's position
+    column_to_elo_rating_and_meta_data["total_match_number"] = np.arange(1, len(winner_codes) + 1).repeat(2)
+    column_to_elo_rating_and_meta_data["pairing_index"] = np.tile([0, 1], len(winner_codes))
+
+    # Getting the rankings after every match at once, instead of sorting every subject after each match
+    # Each row of the history has the Elo rating of every subject after that match, carried forward from the
+    # subject's last match, and -inf for subjects that have not been in a match yet so that they are not ranked
+    all_match_numbers = np.arange(len(winner_codes))
+    elo_rating_history = np.full((len(winner_codes), len(all_ids)), np.nan)
+    updated_elo_ratings = np.array(column_to_elo_rating_and_meta_data["updated_elo_rating"], dtype=float)
+    elo_rating_history[all_match_numbers, winner_codes] = updated_elo_ratings[0::2]
+    elo_rating_history[all_match_numbers, loser_codes] = updated_elo_ratings[1::2]
+    elo_rating_history = pd.DataFrame(elo_rating_history).ffill().fillna(-np.inf).to_numpy()
+    # Lower ranks like 1 are the subjects with higher Elo ratings
+    # The stable sort keeps subjects with the same rating in the order that they were first seen,
+    # the same as in get_ranking_from_elo_rating_dictionary
+    ranking_history = np.empty(elo_rating_history.shape, dtype=int)
+    ranking_history[all_match_numbers[:, None], np.argsort(-elo_rating_history, axis=1, kind="stable")] = \
+        np.arange(1, len(all_ids) + 1)
+    winner_rankings = ranking_history[all_match_numbers, winner_codes]
+    loser_rankings = ranking_history[all_match_numbers, loser_codes]
+    column_to_elo_rating_and_meta_data["subject_ranking"] = np.column_stack([winner_rankings, loser_rankings]).ravel()
+    column_to_elo_rating_and_meta_data["agent_ranking"] = np.column_stack([loser_rankings, winner_rankings]).ravel()
+
+    # The additional columns have the same value in the rows of the winner and loser of a match
+    for column in additional_columns:
+        column_to_elo_rating_and_meta_data[column] = all_matches_dataframe[column].to_numpy().repeat(2)
+
+    return pd.DataFrame(column_to_elo_rating_and_meta_data)
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+
+"""Tests for `pc_mouseparty.rank.elorating.calculation`."""
+
+from collections import defaultdict
+
+import pandas as pd
+
+from pc_mouseparty.rank.elorating import calculation
+
+
+def test_iterate_rankings_match_ranking_dictionary():
+    """
+    The rankings of every match should be the same as ranking the Elo
+    ratings after that match with get_ranking_from_elo_rating_dictionary.
+    The matches have ties, subjects with the same rating, subjects that
+    join after the first matches, and IDs that are not first seen in
+    sorted order.
+    """
+    matches = pd.DataFrame({
+        "winner": ["f", "e", "c", "f", "d", "b", "c", "a", "d", "f"],
+        "loser": ["c", "b", "e", "d", "c", "f", "e", "d", "a", "b"],
+        "tie": [None, None, "tie", None, "tie", None, "tie", None,
+                "tie", None],
+    })
+
+    elo_df = calculation.iterate_elo_rating_calculation_for_dataframe(
+        dataframe=matches, winner_id_column="winner",
+        loser_id_column="loser", tie_column="tie")
+
+    # Getting the rankings after each match, one match at a time
+    id_to_elo_rating = defaultdict(lambda: 1000)
+    subject_rankings, agent_rankings = [], []
+    had_same_rating = False
+    for winner_id, loser_id, tie in matches.itertuples(index=False):
+        winner_score, loser_score = (0.5, 0.5) if tie else (1, 0)
+        calculation.update_elo_rating(
+            winner_id=winner_id, loser_id=loser_id,
+            id_to_elo_rating=id_to_elo_rating,
+            winner_score=winner_score, loser_score=loser_score)
+        winner_ranking = calculation.get_ranking_from_elo_rating_dictionary(
+            id_to_elo_rating, winner_id)
+        loser_ranking = calculation.get_ranking_from_elo_rating_dictionary(
+            id_to_elo_rating, loser_id)
+        subject_rankings += [winner_ranking, loser_ranking]
+        agent_rankings += [loser_ranking, winner_ranking]
+        had_same_rating |= \
+            len(set(id_to_elo_rating.values())) < len(id_to_elo_rating)
+
+    # Making sure the matches had subjects with the same rating
+    assert had_same_rating
+    assert elo_df["subject_ranking"].tolist() == subject_rankings
+    assert elo_df["agent_ranking"].tolist() == agent_rankings